@@ -4,6 +4,10 @@ import codecs
 import os.path
 import re
 import sys
+from labelimg import importTimes
+if importTimes.enabled():  # time everything imported from here on
+    importTimes.install()
+import atexit
 import subprocess
 import numpy as np
 
@@ -27,13 +31,15 @@ from labelimg.colorDialog import ColorDialog
 from labelimg.toolBar import ToolBar
 from labelimg.ustr import ustr
 from labelimg.kaspard_utils import adapt_pcd, reverse_adapt_pcd
-from labelimg.kaspard_utils import read_config, write_config, read_pcd, save_image_from_pcd
-from labelimg.kaspard_utils import segment_floor, segment_bed, init_networks
-from labelimg.kaspard_utils import add_to_predict_queue, create_predict_server, predict_config
+from labelimg.kaspard_utils import read_config, write_config
+from labelimg.kaspard_utils import add_to_predict_queue, create_predict_server
+from labelimg.frames import FrameCache, FramePrefetcher, load_frame
+from labelimg.kaspard_utils import warm_up_kernels
 from labelimg.utils import sorted_nicely
 import labelimg.labelFile as labelIO
 import time
 import collections
+import threading
 
 
 __appname__ = 'labelImg'
@@ -81,6 +87,8 @@ class HashableQListWidgetItem(QListWidgetItem):
 
 class MainWindow(QMainWindow, WindowMixin):
     FIT_WINDOW, FIT_WIDTH, MANUAL_ZOOM = list(range(3))
+    CAM_INTERVAL = 33  # ms, at most one floor rotation per frame
+    FRAME_CACHE_BYTES = 1 << 30  # loaded frames kept for going back to them
 
     def __init__(self, defaultFilename=None, defaultPrefdefClassFile=None):
         super(MainWindow, self).__init__()
@@ -172,6 +180,19 @@ class MainWindow(QMainWindow, WindowMixin):
         labeledYawSlider.addWidget(self.yawSlider)
         labeledYawSlider.addWidget(self.yawLabel)
 
+        # Coalesce dial events: only the latest camera config is kept and
+        # applied at most once per interval, or right away on release.
+        # While a dial is held only a low resolution preview is computed.
+        self._pendingCam = None
+        self._camDragging = False
+        self.camTimer = QTimer(self)
+        self.camTimer.setSingleShot(True)
+        self.camTimer.setInterval(self.CAM_INTERVAL)
+        self.camTimer.timeout.connect(self.applyCam)
+        for slider in (self.heightSlider, self.pitchSlider, self.yawSlider):
+            slider.sliderPressed.connect(self.camPressed)
+            slider.sliderReleased.connect(self.camReleased)
+
         dials = QHBoxLayout()
         dials.addLayout(labeledPitchSlider)
         dials.addLayout(labeledYawSlider)
@@ -536,13 +557,29 @@ class MainWindow(QMainWindow, WindowMixin):
 
         # Load segmentation models
         data_dir = Path(__file__).parent / "data"
-        self.floor_model, self.bed_model = init_networks([data_dir/"models/floor", data_dir/"models/bed"])
-
-        self.queue, self.predict_process, self.tempdir = create_predict_server([data_dir/"models/floor", data_dir/"models/bed"])
+        # Each worker holds its own copy of the networks
+        # (LABELIMG_PREDICT_WORKERS=n, half of the cores by default)
+        n_workers = os.environ.get("LABELIMG_PREDICT_WORKERS", "")
+        n_workers = max(1, int(n_workers)) if n_workers.isdigit() else None
+        self.queue, self.predict_processes, self.tempdir = create_predict_server(
+            [data_dir/"models/floor", data_dir/"models/bed"], n_workers
+        )
         add_to_qpartial = partial(add_to_predict_queue, filelist=self.mImgList, queue=self.queue)
         self.fileListWidget.model().rowsInserted.connect(add_to_qpartial)
+        # Loads the files around the current one in the background
+        # and keeps the last ones viewed
+        self.prefetcher = FramePrefetcher(
+            partial(load_frame, queue=self.queue),
+            cache=FrameCache(self.FRAME_CACHE_BYTES)
+        )
         self._loader = None
         self._loaderOk = collections.deque()
+        self._loadError = None
+
+        # Compile the point cloud kernels while the window comes up
+        # (LABELIMG_WARM_UP=0 to skip it)
+        if os.environ.get("LABELIMG_WARM_UP", "1") != "0":
+            threading.Thread(target=warm_up_kernels, daemon=True).start()
 
     ## Support Functions ##
 
@@ -652,6 +689,9 @@ class MainWindow(QMainWindow, WindowMixin):
         self.labelList.clear()
         self.filePath = None
         self.imageData = None
+        # Drop camera changes still pending for the previous file
+        self.camTimer.stop()
+        self._pendingCam = None
         self.canvas.resetState()
 
     def currentItem(self):
@@ -830,11 +870,32 @@ class MainWindow(QMainWindow, WindowMixin):
         """ One of the three dials was used """
         cam = self._getCam()
 
-        self.canvas.setCamRotation(cam)
+        self._pendingCam = cam
+        if not self.camTimer.isActive():
+            self.camTimer.start()
+        self._showCam(cam)
+        self.setDirty()
+
+    def _showCam(self, cam):
         self.heightLabel.setText(f"{cam['height']:.2f} m")
         self.pitchLabel.setText(f"{cam['inclination']:2.1f}°")
         self.yawLabel.setText(f"{cam['lateral_inclination']:2.1f}°")
-        self.setDirty()
+
+    def applyCam(self):
+        """ Rotates the floor with the latest pending cam config """
+        self.camTimer.stop()
+        if self._pendingCam is not None:
+            cam, self._pendingCam = self._pendingCam, None
+            self.canvas.setCamRotation(cam, preview=self._camDragging)
+
+    def camPressed(self):
+        self._camDragging = True
+
+    def camReleased(self):
+        """ Replaces the preview by a full resolution rotation """
+        self._camDragging = False
+        self._pendingCam = self._getCam()
+        self.applyCam()
 
     def loadLabels(self, confpath):
         if self.filePath is None:
@@ -862,10 +923,17 @@ class MainWindow(QMainWindow, WindowMixin):
         self.canvas.loadShapes(s, repaint=False)
         self._tmp_shapes = s
 
-        # Setting floor inclination
+        # Setting floor inclination, already applied by the loaded frame: the
+        # rounded slider values mustn't rotate it again nor mark it dirty
+        sliders = (self.heightSlider, self.pitchSlider, self.yawSlider)
+        for slider in sliders:
+            slider.blockSignals(True)
         self.heightSlider.setValue(cam["height"]*self.heightSliderScale)
         self.pitchSlider.setValue(cam["inclination"]*self.pitchSliderScale)
         self.yawSlider.setValue(cam["lateral_inclination"]*self.yawSliderScale)
+        for slider in sliders:
+            slider.blockSignals(False)
+        self._showCam(self._getCam())
 
     def loadTmpShapes(self):
         if hasattr(self, "_tmp_shapes"):  # Check if image wasn't skipped too fast
@@ -899,6 +967,8 @@ class MainWindow(QMainWindow, WindowMixin):
         # Can add differrent annotation formats here
         try:
             labelIO.saveKaspardFormat(annotationFilePath, shapes, cam, self.default_labels)
+            # A frame loaded before the save would be outdated
+            self.prefetcher.discard(self.filePath)
             return True
         except IOError as e:
             self.errorMessage(u'Error saving label data',
@@ -1011,6 +1081,8 @@ class MainWindow(QMainWindow, WindowMixin):
             index = self.mImgSet[filePath]
             fileWidgetItem = self.fileListWidget.item(index)
             fileWidgetItem.setSelected(True)
+            # Pre-annotate the files around the current one first
+            self.queue.set_focus(index)
 
         if unicodeFilePath and os.path.exists(unicodeFilePath):
             self.finished = False
@@ -1023,35 +1095,29 @@ class MainWindow(QMainWindow, WindowMixin):
                     self.parent._loaderOk.append(False)
                     # Paths
                     self.parent.filePath = unicodeFilePath
-                    pfilepath = Path(self.parent.filePath)
-
-                    # check for extension
-                    fp = Path(filePath)
-                    pcd, self.parent.kaspardpath = predict_config(fp, self.parent.floor_model, self.parent.bed_model, Path(self.parent.tempdir.name))
-
-                    # Load image
-                    if (fp.parents[1] / "image").exists():
-                        imgPath = fp.parents[1] / "image" / (fp.stem+".png")
-                    else:
-                        imgPath = fp.parent / (fp.stem + ".png")
-                    if not imgPath.exists(): # create image for easier reloading
-                        if pcd is None:
-                            pcd = read_pcd(pfilepath)
-                        save_image_from_pcd(imgPath, pcd)
-                    self.parent.imageData = read(imgPath, None)
-                    image = QImage.fromData(self.parent.imageData)
+
+                    # Prefetched frame if there is one, otherwise loaded now
+                    self.parent._loadError = None
+                    try:
+                        frame = self.parent.prefetcher.take(filePath)
+                    except Exception as e:  # e.g. no prediction worker left
+                        self.parent._loadError = str(e)
+                        self.parent.image = QImage()
+                        self.parent.canvas.setLoading(False)
+                        self.parent._loaderOk.append(True)
+                        return
+                    self.parent.kaspardpath = frame.kaspardpath
+                    self.parent.imageData = frame.imageData
+                    image = frame.image
                     if image.isNull():
                         self.parent.canvas.setLoading(False)
                         self.parent._loaderOk.append(True)
                         return
 
                     self.parent.image = image
-                    samplePaths = {
-                        "conf": self.parent.kaspardpath,
-                        "image": imgPath,
-                        "pcd": self.parent.filePath
-                    }
-                    self.parent.canvas.loadPixmap(image, samplePaths, repaint=False)
+                    self.parent.canvas.loadPixmap(
+                        image, repaint=False, img_pcd=frame.img_pcd
+                    )
                     # Load label
                     if os.path.isfile(self.parent.kaspardpath):
                         self.parent.loadLabels(self.parent.kaspardpath)
@@ -1088,8 +1154,9 @@ class MainWindow(QMainWindow, WindowMixin):
             return
         self._loaderOk.popleft()
         if self.image.isNull():
-            self.errorMessage(u'Error opening file',
-                            u"<p>Make sure <i>%s</i> is a valid image file." % self.filePath)
+            message = self._loadError or \
+                u"Make sure <i>%s</i> is a valid image file." % self.filePath
+            self.errorMessage(u'Error opening file', u"<p>%s" % message)
             self.status("Error reading %s" % self.filePath)
             return
         self.status("Loaded %s" % os.path.basename(self.filePath))
@@ -1108,6 +1175,8 @@ class MainWindow(QMainWindow, WindowMixin):
         self.canvas.setFocus(True)
         self.finished = True # Let other events pass
         self._loader = None # Let thread be GC'ed
+        if self.filePath in self.mImgSet:
+            self.prefetcher.prefetch(self.mImgList, self.mImgSet[self.filePath])
 
     def resizeEvent(self, event):
         if self.canvas and not self.image.isNull()\
@@ -1146,9 +1215,13 @@ class MainWindow(QMainWindow, WindowMixin):
     def closeEvent(self, event):
         if not self.mayContinue():
             event.ignore()
+            return
 
         # self.queue.close()
-        self.predict_process.terminate()
+        self.prefetcher.shutdown()
+        for process in self.predict_processes:
+            process.terminate()
+        self.queue.close()
         self.tempdir.cleanup()
         # self.predict_process.join()
         s = self.settings
@@ -1233,6 +1306,8 @@ class MainWindow(QMainWindow, WindowMixin):
 
         self.dirname = dirpath
         self.filePath = None
+        self.queue.clear()
+        self.prefetcher.clear()
         self.fileListWidget.clear()
         self.fileListFromOpenDir = True
         self.mImgList.clear()
@@ -1315,6 +1390,8 @@ class MainWindow(QMainWindow, WindowMixin):
             if isinstance(filename, (tuple, list)):
                 filename = filename[0]
             if self.fileListFromOpenDir: # Clear files opened with openDir
+                self.queue.clear()
+                self.prefetcher.clear()
                 self.fileListWidget.clear()
                 self.fileListFromOpenDir = False
                 self.mImgList.clear()
@@ -1510,6 +1587,10 @@ def get_main_app(argv=[]):
     win = MainWindow(argv[1] if len(argv) >= 2 else None,
                      argv[2] if len(argv) >= 3 else os.path.join(Path(__file__).parent, 'data', 'predefined_classes.txt'))
     win.show()
+    if importTimes.enabled():
+        # Once the event loop runs the window is interactive
+        QTimer.singleShot(0, partial(importTimes.report, "startup"))
+        atexit.register(importTimes.report, "session")
     return app, win
 
 
@@ -3,9 +3,11 @@ try:
     from PyQt5.QtGui import *
     from PyQt5.QtCore import *
     from PyQt5.QtWidgets import *
+    from PyQt5 import sip
 except ImportError:
     from PyQt4.QtGui import *
     from PyQt4.QtCore import *
+    import sip
 
 #from PyQt4.QtOpenGL import *
 
@@ -23,6 +25,17 @@ CURSOR_MOVE = Qt.ClosedHandCursor
 CURSOR_GRAB = Qt.OpenHandCursor
 
 
+def wrapRGB(array):
+    """ QImage sharing the memory of the (h, w, 3) uint8 `array`, which must
+        outlive it. Wrapped as writable memory so that bits() doesn't copy it
+    """
+    h, w = array.shape[:2]
+    return QImage(
+        sip.voidptr(array.ctypes.data), w, h, array.strides[0],
+        QImage.Format_RGB888
+    )
+
+
 class Canvas(QWidget):
     zoomRequest = pyqtSignal(int)
     scrollRequest = pyqtSignal(int, int)
@@ -55,7 +68,9 @@ class Canvas(QWidget):
         self.offsets = QPointF(), QPointF()
         self.scale = 1.0
         self.pixmap = QPixmap()
-        self.views = (QPixmap(), QPixmap())
+        self.views = (QImage(), QImage())
+        self._viewBuffers = None  # arrays wrapped by self.views
+        self._segmentationKey = None
         self.visible = {}
         self._hideBackround = False
         self.hideBackround = False
@@ -555,18 +570,19 @@ class Canvas(QWidget):
             shape for shape in self.shapes if\
                 (shape.selected or not self._hideBackround) and self.isVisible(shape)
         ]
-        seg_images = self.img_pcd.segment_img(
-            visible_shapes, self.shape[1], self.hide_floor
-        )
-        pcd_zcolor = self.img_pcd.zcolor
-        pcd_icolor = self.img_pcd.icolor
-
-        self.views = []
-        for simg in seg_images:
-            h,w,c = simg.shape
-            simg = QImage(simg, w, h, w*3, QImage.Format_RGB888)
-            simg = QPixmap(simg)
-            self.views.append(simg)
+        key = self.segmentationKey(visible_shapes)
+        if key != self._segmentationKey:  # Hover/cursor repaints reuse the views
+            # Written in place in the same buffers for a given frame
+            buffers = self.img_pcd.segment_img(
+                visible_shapes, self.shape[1], self.hide_floor
+            )
+            if buffers is not self._viewBuffers:
+                self._viewBuffers = buffers
+                self.views = tuple(wrapRGB(buffer) for buffer in buffers)
+            else:
+                for view in self.views:
+                    view.bits()  # new cacheKey, the pixels changed
+            self._segmentationKey = key
 
         # Paint rest of the data
         p = self._painter
@@ -583,15 +599,13 @@ class Canvas(QWidget):
         pcdh = self.pixmap.height()*2.05
         pcdw = pcdh*2
         mid_pcdh = self.pixmap.height()*1.05
-        p.drawPixmap(pcdw, 0, self.views[0])
-        p.drawPixmap(pcdw, self.pixmap.height()*1.05, self.views[1])
+        p.drawImage(QPointF(pcdw, 0), self.views[0])
+        p.drawImage(QPointF(pcdw, self.pixmap.height()*1.05), self.views[1])
 
-        # Draw pcd projection on floor
-        pcolor = pcd_zcolor if self.showZColor else pcd_icolor
-        for i in range(len(self.img_pcd.pcd2d)):
-            (x, y), color = self.img_pcd.pcd2d[i,:-1], pcolor[i]
-            p.setPen(color)
-            p.drawPoint(x*pcdh, y*pcdh)
+        # Draw pcd projection on floor (points must stay sharp when zoomed)
+        p.setRenderHint(QPainter.SmoothPixmapTransform, False)
+        p.drawImage(0, 0, self.img_pcd.floor_image(pcdh, self.showZColor))
+        p.setRenderHint(QPainter.SmoothPixmapTransform)
 
 
         Shape.scale = self.scale
@@ -633,6 +647,15 @@ class Canvas(QWidget):
 
         p.end()
 
+    def segmentationKey(self, visible_shapes):
+        """Everything the segmented views depend on"""
+        shapes = tuple(
+            (shape.label, tuple((p.x(), p.y()) for p in shape.points))
+            for shape in visible_shapes
+        )
+        camera = tuple(sorted(self.img_pcd.camera.items()))
+        return shapes, self.shape[1], self.hide_floor, camera
+
     def transformPos(self, point):
         """Convert from widget-logical coordinates to painter-logical coordinates."""
         return point / self.scale - self.offsetToCenter()
@@ -877,10 +900,15 @@ class Canvas(QWidget):
         self.drawingPolygon.emit(False)
         self.update()
 
-    def loadPixmap(self, img, samplePaths, repaint=True):
-        self.img_pcd = ImgPcd(samplePaths)
+    def loadPixmap(self, img, samplePaths=None, repaint=True, img_pcd=None):
+        """ Displays `img` with the point cloud of `samplePaths`, or the
+            already built `img_pcd`
+        """
+        self.img_pcd = img_pcd if img_pcd is not None else ImgPcd(samplePaths)
         pmap = QPixmap.fromImage(img)
-        self.views = (pmap, pmap)
+        self.views = (img, img)
+        self._viewBuffers = None
+        self._segmentationKey = None
         self.shapes = []
         self.pixmap = pmap
         if repaint:
@@ -908,12 +936,14 @@ class Canvas(QWidget):
         self.restoreCursor()
         self.pixmap = None
         self.views = (None, None)
+        self._viewBuffers = None
+        self._segmentationKey = None
         self.update()
         self.img_pcd = None
 
-    def setCamRotation(self, camCfg):
+    def setCamRotation(self, camCfg, preview=False):
         if self.img_pcd is not None:
-            self.img_pcd.rotate_floor(self.img_pcd.make_cfg(**camCfg))
+            self.img_pcd.rotate_floor(self.img_pcd.make_cfg(**camCfg), preview)
             self.repaint()
 
     def copyShapes(self):
@@ -0,0 +1,213 @@
+try:
+    from PyQt5.QtGui import QImage
+except ImportError:
+    from PyQt4.QtGui import QImage
+
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+import os
+import threading
+
+from labelimg.kaspard_utils import ImgPcd, config_path, read_pcd, save_image_from_pcd
+
+
+def image_path(fp):
+    """ Gray image of a point cloud, in the "image" folder next to the pcd
+        folder if there is one
+    """
+    if (fp.parents[1] / "image").exists():
+        return fp.parents[1] / "image" / (fp.stem+".png")
+    return fp.parent / (fp.stem + ".png")
+
+
+class Frame(object):
+    """ Everything the canvas needs to display a file """
+    def __init__(self, filePath, kaspardpath, imgPath, imageData, image, img_pcd):
+        self.filePath = filePath
+        self.kaspardpath = kaspardpath
+        self.imgPath = imgPath
+        self.imageData = imageData
+        self.image = image
+        self.img_pcd = img_pcd  # None when the image couldn't be read
+        self.key = frame_key(filePath, kaspardpath)
+
+    @property
+    def nbytes(self):
+        nbytes = len(self.imageData or b"")
+        return nbytes + (self.img_pcd.nbytes if self.img_pcd is not None else 0)
+
+
+def _mtime(path):
+    try:
+        return os.stat(path).st_mtime_ns
+    except (OSError, TypeError):
+        return None
+
+
+def frame_key(filePath, kaspardpath=None):
+    """ Changes whenever the point cloud or its config is modified """
+    fp = Path(filePath)
+    if kaspardpath is None:
+        kaspardpath = config_path(fp)
+    return (str(filePath), _mtime(fp), _mtime(kaspardpath))
+
+
+def load_frame(filePath, queue):
+    """ Reads (and annotates first if needed) the file at `filePath` """
+    fp = Path(filePath)
+    # Wait for the prediction workers to annotate it if needed
+    queue.request(fp).result()
+    kaspardpath = config_path(fp)
+
+    imgPath = image_path(fp)
+    if not imgPath.exists(): # create image for easier reloading
+        save_image_from_pcd(imgPath, read_pcd(fp))
+    try:
+        with open(imgPath, 'rb') as f:
+            imageData = f.read()
+    except OSError:
+        imageData = None
+    image = QImage.fromData(imageData) if imageData is not None else QImage()
+
+    img_pcd = None
+    if not image.isNull():
+        img_pcd = ImgPcd({"conf": kaspardpath, "image": imgPath, "pcd": filePath})
+    return Frame(filePath, kaspardpath, imgPath, imageData, image, img_pcd)
+
+
+class FrameCache(object):
+    """ Least recently viewed frames, within `max_bytes` of numpy arrays.
+        A frame is only reused while its files are unmodified.
+    """
+    def __init__(self, max_bytes=1 << 30):
+        self.max_bytes = max_bytes
+        self.hits = self.misses = 0
+        self._frames = OrderedDict()  # path -> Frame, most recent last
+        self._lock = threading.Lock()
+
+    def get(self, path):
+        """ Cached frame of `path`, reset to its saved camera, or None """
+        key = frame_key(path)
+        with self._lock:
+            frame = self._frames.get(str(path))
+            if frame is not None and frame.key != key:
+                del self._frames[str(path)]  # outdated
+                frame = None
+            if frame is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._frames.move_to_end(str(path))
+        if frame.img_pcd is not None:
+            frame.img_pcd.reset_camera()
+        return frame
+
+    def __contains__(self, path):
+        with self._lock:
+            frame = self._frames.get(str(path))
+        return frame is not None and frame.key == frame_key(path)
+
+    def put(self, frame):
+        with self._lock:
+            self._frames[str(frame.filePath)] = frame
+            self._frames.move_to_end(str(frame.filePath))
+            # Sizes change as the frames are viewed (masks, rotations)
+            sizes = [f.nbytes for f in self._frames.values()]
+            total = sum(sizes)
+            for path, size in zip(list(self._frames), sizes):
+                if total <= self.max_bytes or len(self._frames) == 1:
+                    break
+                del self._frames[path]
+                total -= size
+
+    def discard(self, path):
+        with self._lock:
+            self._frames.pop(str(path), None)
+
+    def clear(self):
+        with self._lock:
+            self._frames.clear()
+
+    @property
+    def nbytes(self):
+        with self._lock:
+            return sum(f.nbytes for f in self._frames.values())
+
+    def __repr__(self):
+        return "FrameCache({} frames, {:.1f}MB, {} hits, {} misses)".format(
+            len(self._frames), self.nbytes/2**20, self.hits, self.misses
+        )
+
+
+class FramePrefetcher(object):
+    """ Loads the `radius` files before and after the current one with a
+        pool of `n_workers` threads, so that moving to them is instant. The
+        frames already in `cache` aren't loaded again.
+    """
+    def __init__(self, load, n_workers=2, radius=2, cache=None):
+        self.load = load
+        self.radius = radius
+        self.cache = cache if cache is not None else FrameCache()
+        self._pool = ThreadPoolExecutor(max_workers=n_workers)
+        self._futures = {}  # path -> Future of a Frame
+        self._lock = threading.Lock()
+
+    def prefetch(self, filelist, index):
+        """ Schedules the neighbours of filelist[index], nearest first, and
+            drops the frames that went out of range
+        """
+        paths = []
+        for offset in range(1, self.radius+1):
+            for i in (index+offset, index-offset):
+                if 0 <= i < len(filelist):
+                    paths.append(filelist[i])
+        with self._lock:
+            for path in set(self._futures) - set(paths):
+                self._futures.pop(path).cancel()
+            for path in paths:
+                if path not in self._futures and path not in self.cache:
+                    self._futures[path] = self._pool.submit(self.load, path)
+
+    def take(self, path):
+        """ Returns the Frame of `path`, prefetched if possible. Blocks until
+            it is loaded
+        """
+        with self._lock:
+            future = self._futures.pop(path, None)
+        # A load still queued behind the other neighbours is dropped, only a
+        # running (or finished) one is worth waiting for
+        running = future is not None and not future.cancel()
+        frame = self.cache.get(path)
+        if frame is not None:
+            return frame
+        if running:
+            try:
+                frame = future.result()
+            except Exception:
+                pass  # the file may have changed meanwhile
+            if frame is not None and frame.key != frame_key(path):
+                frame = None  # modified since it was loaded
+        if frame is None:
+            frame = self.load(path)
+        self.cache.put(frame)
+        return frame
+
+    def discard(self, path):
+        """ Forgets the frame of `path`, e.g. once it's modified """
+        with self._lock:
+            future = self._futures.pop(path, None)
+        if future is not None:
+            future.cancel()
+        self.cache.discard(path)
+
+    def clear(self):
+        with self._lock:
+            futures, self._futures = self._futures, {}
+        for future in futures.values():
+            future.cancel()
+        self.cache.clear()
+
+    def shutdown(self):
+        self.clear()
+        self._pool.shutdown(wait=False)
@@ -0,0 +1,57 @@
+""" Import time report, enabled by setting LABELIMG_IMPORT_TIMES=1.
+
+    Every module imported after `install()` is timed, and the time is charged
+    to its top-level package (nested imports of other packages are charged to
+    those). `report()` prints the packages sorted by cost on stderr.
+"""
+import builtins
+import sys
+import threading
+import time
+
+_import = builtins.__import__
+_times = {}  # top-level package -> seconds
+_local = threading.local()
+
+
+def enabled():
+    import os
+    return bool(os.environ.get("LABELIMG_IMPORT_TIMES"))
+
+
+def _loaded(name, fromlist):
+    """ Whether `name` and the submodules in `fromlist` are all imported """
+    module = sys.modules.get(name)
+    if module is None:
+        return False
+    if not fromlist or not hasattr(module, "__path__"):
+        return True
+    return all(item == "*" or hasattr(module, item) for item in fromlist)
+
+
+def _timed_import(name, globals=None, locals=None, fromlist=(), level=0):
+    if level or _loaded(name, fromlist):
+        return _import(name, globals, locals, fromlist, level)
+    nested = _local.__dict__.setdefault("nested", [])
+    nested.append(0.0)
+    start = time.perf_counter()
+    try:
+        return _import(name, globals, locals, fromlist, level)
+    finally:
+        elapsed = time.perf_counter() - start
+        top = name.partition(".")[0]
+        _times[top] = _times.get(top, 0.0) + elapsed - nested.pop()
+        if nested:
+            nested[-1] += elapsed
+
+
+def install():
+    builtins.__import__ = _timed_import
+
+
+def report(title, limit=20):
+    total = sum(_times.values())
+    lines = ["Import times ({}): {:.3f}s".format(title, total)]
+    for name, seconds in sorted(_times.items(), key=lambda kv: -kv[1])[:limit]:
+        lines.append("  {:8.3f}s  {}".format(seconds, name))
+    print("\n".join(lines), file=sys.stderr)
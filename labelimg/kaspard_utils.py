@@ -1,18 +1,24 @@
-import open3d
-from kapnet.utils.io import read_sample, write_sample
 import numpy as np
 from pathlib import Path
-import matplotlib.pyplot as plt
-import matplotlib.cm as cmx
-from numba import jit
-from collections import defaultdict
-from kapnet.predict import init as predict_init, predict_floor, predict_object
-from kapnet.annotations.image import generate_sample as image_generate_sample
+import os
+import shutil
+import hashlib
 import multiprocessing as mp
+import threading
+import heapq
+import re
+import time
 from multiprocessing import Process, Queue
 from filelock import FileLock
-from tempfile import TemporaryDirectory
-from PyQt5.QtGui import QColor
+from queue import Empty
+from concurrent.futures import Future
+from tempfile import TemporaryDirectory, mkdtemp
+from PyQt5.QtGui import QImage
+from labelimg.colormaps import MAGMA, VIRIDIS
+
+# numba (labelimg.kernels) and kapnet are slow to import: they are imported
+# on first use so that the window shows up first
+_parallel_lock = threading.Lock()
 
 
 def adapt_pcd(pcd):
@@ -25,89 +31,359 @@ def reverse_adapt_pcd(pcd):
     pcd[:,1] = 5.0-pcd[:,1]*5.0
     return pcd
 
+def pack_argb(r, g, b):
+    """ Packs 8-bit color channels into opaque 0xAARRGGBB pixels """
+    r, g, b = (np.asarray(c).astype(np.uint32) for c in (r, g, b))
+    return np.uint32(0xFF000000) | (r<<16) | (g<<8) | b
+
+
 class ImgPcd():
     FLIM = 0.10  # Max floor height
     ZFLIM = 2.2   # Max height
     XYLIM = 5.0  # Max distance from camera
-    _CNORM = plt.Normalize(vmin=FLIM, vmax=ZFLIM)
-    CMAP = cmx.ScalarMappable(norm=_CNORM, cmap=plt.get_cmap("magma"))
-    CMAP_IMG = cmx.ScalarMappable(norm=_CNORM, cmap=plt.get_cmap("viridis"))
+    GRID_CELL = 0.02  # Cell size of the point grid in adapted units (10cm)
+    PREVIEW_STRIDE = 4  # Keeps 1 point out of 4x4 while dragging the dials
+    # Colormaps over [FLIM, ZFLIM]: packed pixels for the floor, rgb for zimage
+    CMAP = pack_argb(*MAGMA.T)
+    CMAP_IMG = VIRIDIS
+    # Opt-in directory where the rotated clouds are saved to be memory-mapped
+    # when the frame is loaded again
+    cache_dir = os.environ.get("LABELIMG_CACHE_DIR") or None
+    CACHED = ("img", "rotated_pcd", "xy", "zimage", "pcd2d", "zcolor", "icolor")
+    CACHE_MAX_BYTES = 2 << 30
     def __init__(self, samplePaths):
-        sample = read_sample(samplePaths)
-        self.pcd = sample["pcd"]["points"]
-        self.cfg = sample["conf"]
-        self.img = sample["image"].copy().astype(np.uint8)
+        from kapnet.utils.io import read_sample
+        self.samplePaths = samplePaths
+        self.cfg = read_sample({"conf": samplePaths["conf"]})["conf"]
+        self._source = self._source_key() if self.cache_dir else None
+        self._pcd = None  # mapped on first use, a cached frame may not need it
+        entry = self._cache_entry(self.cfg)
+        if entry is not None and (entry / "img.npy").exists():
+            self.img = np.load(entry / "img.npy", mmap_mode="r")
+        else:
+            image = read_sample({"image": samplePaths["image"]})["image"]
+            self.img = image.astype(np.uint8)
         self.img3d = np.stack([self.img, self.img, self.img], axis=-1)
+        self.rotated_pcd = self._preview_pcd = None  # reused across rotations
+        self._ids = self.segmented = None  # reused across segmentations
         self.rotate_floor(self.cfg)
 
+    @property
+    def pcd(self):
+        if self._pcd is None:
+            self._pcd = read_points(self.samplePaths["pcd"])
+        return self._pcd
+
+    def _source_key(self):
+        """ Identifies the version of the pcd and image files """
+        key = []
+        for name in ("pcd", "image"):
+            path = Path(self.samplePaths[name]).resolve()
+            stat = path.stat()
+            key.append((str(path), stat.st_size, stat.st_mtime_ns))
+        return key
+
+    def _cache_entry(self, cfg):
+        """ Cache folder of the rotation by `cfg`, None when caching is off.
+            Its name starts with a digest of the file paths, shared by all the
+            entries of this sample
+        """
+        if self._source is None:
+            return None
+        camera = sorted(cfg["camera"].items())
+        paths = [path for path, _, _ in self._source]
+        prefix = hashlib.sha1(repr(paths).encode()).hexdigest()[:16]
+        digest = hashlib.sha1(repr((self._source, camera)).encode()).hexdigest()
+        return Path(self.cache_dir) / "{}-{}".format(prefix, digest)
+
+    def _load_cache(self, entry):
+        try:
+            for name in self.CACHED:
+                setattr(self, name, np.load(entry / (name+".npy"), mmap_mode="r"))
+            order, starts, origin, shape = (
+                np.load(entry / (name+".npy"))
+                for name in ("order", "starts", "origin", "grid")
+            )
+        except (OSError, ValueError):
+            return False
+        try:
+            os.utime(entry)  # most recently used, see _prune_cache
+        except OSError:
+            pass
+        self._grid = (
+            order, starts, origin, float(shape[0]), int(shape[1]), int(shape[2])
+        )
+        self._rotation_masks()
+        self._floor_key = None
+        return True
+
+    def _save_cache(self, entry):
+        """ Writes the arrays in a temporary folder renamed at the end, so
+            that a concurrent reader never sees a partial entry
+        """
+        order, starts, origin, cell, nx, ny = self._grid
+        arrays = {name: getattr(self, name) for name in self.CACHED}
+        arrays.update(
+            order=order, starts=starts, origin=origin,
+            grid=np.array([cell, nx, ny], dtype=np.float64)
+        )
+        try:
+            Path(self.cache_dir).mkdir(parents=True, exist_ok=True)
+            tmp = mkdtemp(dir=self.cache_dir)
+        except OSError:
+            return
+        try:
+            for name, array in arrays.items():
+                np.save(Path(tmp) / (name+".npy"), np.ascontiguousarray(array))
+            os.replace(tmp, entry)
+        except OSError:  # written by someone else meanwhile, or no space left
+            shutil.rmtree(tmp, ignore_errors=True)
+        self._prune_cache(entry)
+
+    def _prune_cache(self, entry):
+        """ Removes the other entries of this sample (other camera or older
+            files), then the least recently used ones beyond CACHE_MAX_BYTES
+        """
+        prefix = entry.name.partition("-")[0] + "-"
+        entries = []
+        for other in Path(self.cache_dir).iterdir():
+            if other == entry or not other.is_dir():
+                continue
+            if other.name.startswith(prefix):
+                shutil.rmtree(other, ignore_errors=True)
+                continue
+            try:
+                size = sum(f.stat().st_size for f in other.iterdir())
+                entries.append((other.stat().st_mtime, size, other))
+            except OSError:  # removed meanwhile
+                continue
+        try:
+            total = sum(f.stat().st_size for f in entry.iterdir())
+        except OSError:
+            total = 0
+        total += sum(size for _, size, _ in entries)
+        for _, size, other in sorted(entries):
+            if total <= self.CACHE_MAX_BYTES:
+                break
+            shutil.rmtree(other, ignore_errors=True)
+            total -= size
+
+    @property
+    def nbytes(self):
+        """ Memory held by the numpy arrays of the sample and its caches """
+        return _nbytes(self.__dict__)
+
+    def reset_camera(self):
+        """ Goes back to the camera of the config, e.g. when the frame is
+            displayed again after edits that weren't saved
+        """
+        if self.previewing or self.camera != self.cfg["camera"]:
+            self.rotate_floor(self.cfg)
+        self._masks = {}
+
     def make_cfg(self, **kwargs):
         camera = {**self.cfg["camera"], **kwargs}
         return {**self.cfg, "camera": camera}
 
-    def rotate_floor(self, cfg):
+    def rotate_floor(self, cfg, preview=False):
+        """ Rotates the cloud so that the floor lies in the xy-plane. With
+            `preview`, only the floor projection is updated, from a
+            1/PREVIEW_STRIDE**2 subsample of the cloud (the segmentation
+            keeps using the last full rotation)
+        """
+        if preview:
+            s = self.PREVIEW_STRIDE
+            h, w = self.img.shape[:2]
+            pcd = self.pcd.reshape(h, w, 3)[::s, ::s].reshape(-1, 3)
+            self._preview_pcd = fast_twconf(pcd, cfg, out=self._preview_pcd)
+            self._project_floor(self._preview_pcd, np.rot90(self.img,2)[::s, ::s])
+            self.previewing = True
+            return
+
+        self.previewing = False
+        self.camera = dict(cfg["camera"])
+        self._masks = {}  # id(shape) -> ((corners, scale), mask)
+        entry = self._cache_entry(cfg)
+        if entry is not None and entry.exists() and self._load_cache(entry):
+            return
+
+        # Everything stays float32 (N, 3) rotated and (N, 2) adapted clouds.
+        # NaN points are left as they are: they fail every comparison below
+        # and the grid skips them.
         self.rotated_pcd = fast_twconf(
-            self.pcd, cfg#, do_bed_transform=False
+            self.pcd, cfg, out=self.rotated_pcd#, do_bed_transform=False
         )
-        pcd = np.nan_to_num(self.rotated_pcd)
-
-        zcolor = np.clip(np.round(self.CMAP.to_rgba(pcd[:,-1])*255), 0,255)
-        zimg = np.clip(np.round(self.CMAP_IMG.to_rgba(pcd[:,-1])*255), 0,255)
+        self.xy = adapt_pcd(self.rotated_pcd[:,:2].copy())
+        self._rotation_masks()
+        self._grid = build_grid(self.xy, self.valid, self.GRID_CELL)
 
+        zimg = apply_colormap(
+            self.rotated_pcd[:,-1], self.CMAP_IMG, self.FLIM, self.ZFLIM
+        )
+        self.zimage = self.to_image(zimg)
+
+        self._project_floor(self.rotated_pcd, np.rot90(self.img,2))
+        # Only the saved camera is cached, not every step of the dials
+        if entry is not None and cfg["camera"] == self.cfg["camera"]:
+            self._save_cache(entry)
+
+    def to_image(self, values):
+        """ View of per-point `values` in image orientation. The cloud is
+            organized: rot90(reshape(values, (H, W)), 2) is its reversal,
+            point i being pixel N-1-i
+        """
+        h, w = self.img.shape[:2]
+        return values[::-1].reshape((h, w)+values.shape[1:])
+
+    def _rotation_masks(self):
+        """ Valid points and points above the floor, which only depend on
+            the rotation, as images for the segmentation
+        """
+        self.valid = np.isfinite(self.xy).all(axis=1)
+        self.valid_img = self.to_image(self.valid)
+        above_floor = self.valid & (self.rotated_pcd[:,-1] > 0.1)
+        self.above_floor_img = self.to_image(above_floor)
+
+    def _project_floor(self, pcd, img):
+        """ Selects the points shown on the floor and their colors, `img`
+            holding the gray value of each point of `pcd` in the same order
+        """
         selected = (pcd[:,-1]>self.FLIM) & (pcd[:,-1]<=self.ZFLIM) &\
                (pcd[:,0]<=self.XYLIM) & (pcd[:,0]>=-self.XYLIM)& (pcd[:,1]<self.XYLIM)
 
-        icolor = np.rot90(self.img,2).reshape(pcd.shape[0])[selected]
-
-        self.zimage = np.rot90(zimg[:,:3].reshape(self.img.shape[:2]+(3,)), 2)
+        icolor = img.reshape(pcd.shape[0])[selected]
 
         pcd = pcd[selected, :]
         self.pcd2d = adapt_pcd(pcd)
-        zcolor = zcolor[selected,:]
-
-        # more efficient caching (QColor call is slow)
-        self.zcolor = [QColor(*cx) for cx in zcolor]
-        self.icolor = [QColor(cx, cx, cx, 255) for cx in icolor]
 
+        # Opaque ARGB32 pixels, directly usable in the floor QImage
+        self.zcolor = apply_colormap(pcd[:,-1], self.CMAP, self.FLIM, self.ZFLIM)
+        self.icolor = pack_argb(icolor, icolor, icolor)
+        self._floor_key = None
+
+    def floor_image(self, size, zcolor=True):
+        """ Returns the top-down projection of the selected points as a QImage
+            where one unit of `pcd2d` spans `size` pixels. The image is only
+            re-rasterized when the size, the color mode or the rotation changes.
+        """
+        key = (size, zcolor)
+        if self._floor_key != key:
+            from labelimg import kernels
+            h, w = int(size)+1, int(2*size)+1
+            buffer = np.zeros((h, w), dtype=np.uint32)  # transparent
+            colors = self.zcolor if zcolor else self.icolor
+            kernels.splat_points(self.pcd2d, colors, float(size), buffer)
+            # QImage doesn't own the data: keep the buffer alive alongside it
+            self._floor_buffer = buffer
+            self._floor_image = QImage(
+                buffer.data, w, h, w*4, QImage.Format_ARGB32_Premultiplied
+            )
+            self._floor_key = key
+        return self._floor_image
+
+    def shape_points(self, shape, scale):
+        """ Indices of the points inside `shape`, only recomputed when the
+            shape's corners (or the scale/rotation) changed
+        """
+        corners = tuple((p.x(), p.y()) for p in shape.points[:3])
+        cached = self._masks.get(id(shape))
+        if cached is None or cached[0] != (corners, scale):
+            from labelimg import kernels
+            # Corners in adapted units rather than the cloud in canvas pixels
+            D, A, B = (
+                np.array(corner, dtype=np.float64)/scale for corner in corners
+            )
+            mask = kernels.segment_img(
+                self.xy, *self._grid, D, A, B,
+                np.zeros(self.xy.shape[0], dtype=bool)
+            )
+            cached = self._masks[id(shape)] = ((corners, scale), np.flatnonzero(mask))
+        return cached[1]
+
+    def label_image(self, visible_shapes, scale):
+        """ uint8 image of the label id (Shape.segment_id) of each pixel, 0
+            where there's none. The last shape wins where they overlap. The
+            image is a view of a buffer reused by the next call
+        """
+        if self._ids is None:
+            self._ids = np.empty(self.xy.shape[0], dtype=np.uint8)
+        self._ids.fill(0)
+        for shape in visible_shapes:
+            self._ids[self.shape_points(shape, scale)] = shape.segment_id
+        return self.to_image(self._ids)
 
     def segment_img(self, visible_shapes, scale, hide_floor):
-        pcd = pcd_orig = self.rotated_pcd
-        pcd = clean_pcd = np.nan_to_num(pcd)
-        pcd = adapt_pcd(pcd[:,:2])
-        pcd = pcd*scale
-
-        ok = defaultdict(lambda: np.zeros(pcd.shape[0], dtype=np.bool))
-        ok["default"] = np.zeros(pcd.shape[0], dtype=np.bool)
-        colors = {}
+        """ Both views with the points of each shape blended with its color.
+            They are written in the same two buffers at every call
+        """
+        from labelimg import kernels
+        ids = self.label_image(visible_shapes, scale)
+        lut = np.zeros((256, 3), dtype=np.uint8)
         for shape in visible_shapes:
-            D = np.array((shape.points[0].x(), shape.points[0].y()))
-            A = np.array((shape.points[1].x(), shape.points[1].y()))
-            B = np.array((shape.points[2].x(), shape.points[2].y()))
-            ok[shape.label] = _segment_img(pcd, D, A, B, ok[shape.label])
-            colors[shape.label] = shape.segment_color
-        imgs = self.img3d.copy(), self.zimage.copy()
-        lok = None
-        for key, ok_key in ok.items():
-            ok_key = (~np.isnan(pcd_orig[:,0])) & ok_key
-            if hide_floor:
-                ok_key = ok_key & (clean_pcd[:,-1]>0.1)
-            ok_key = np.rot90(np.reshape(ok_key, imgs[0].shape[:2]), 2)
-            lok = ok_key
-            if np.sum(ok_key)>0:
-                alpha = 0.4
-                for img in imgs:
-                    im_ok = img[ok_key]
-                    img[ok_key] = alpha*im_ok + (1-alpha)*colors[key]*np.ones_like(im_ok)
-
-        return imgs[0].astype(np.uint8), imgs[1].astype(np.uint8)
-
-
-@jit(nopython=True)
-def _segment_img(pcd, D, A, B, ok): # About 10-50x faster with numba
-    AB, AD, AP = B-A, D-A, pcd-A
-    AB2, AD2 = AB@AB, AD@AD
-    APAB, APAD = AP@AB, AP@AD
-    ok = ok | ((0<APAB) & (APAB<AB2) & (0<APAD) & (APAD<AD2) )
-    return ok
+            lut[shape.segment_id] = shape.segment_color
+        if self.segmented is None:
+            self.segmented = (
+                np.empty(self.img3d.shape, dtype=np.uint8),
+                np.empty(self.img3d.shape, dtype=np.uint8)
+            )
+        kernels.blend_labels(
+            self.img3d, self.zimage, ids,
+            self.above_floor_img if hide_floor else self.valid_img,
+            lut, 0.4, *self.segmented
+        )
+        return self.segmented
+
+
+def _nbytes(obj, seen=None):
+    """ Bytes of the numpy arrays in `obj` and its containers, counting the
+        memory shared by views once
+    """
+    seen = set() if seen is None else seen
+    if isinstance(obj, np.ndarray):
+        while isinstance(obj.base, np.ndarray):
+            obj = obj.base
+        if id(obj) in seen:
+            return 0
+        seen.add(id(obj))
+        return obj.nbytes
+    if isinstance(obj, dict):
+        obj = obj.values()
+    elif not isinstance(obj, (list, tuple)):
+        return 0
+    return sum(_nbytes(o, seen) for o in obj)
+
+
+def apply_colormap(values, lut, vmin, vmax):
+    """ Maps `values` linearly from [vmin, vmax] onto the 256 entries of
+        `lut`, clipping outside values (same binning as matplotlib)
+    """
+    from labelimg import kernels
+    values = np.asarray(values, dtype=np.float32)
+    out = np.empty((len(values),)+lut.shape[1:], dtype=lut.dtype)
+    return kernels.apply_colormap(values, lut, float(vmin), float(vmax), out)
+
+
+def build_grid(xy, valid, cell):
+    """ Buckets the valid points of `xy` in a uniform grid of `cell` sized
+        cells. Returns (order, starts, origin, cell, nx, ny) where the
+        indices of the points in cell (i, j) are
+        order[starts[j*nx+i]:starts[j*nx+i+1]], so that the cells of a row
+        are contiguous in `order`.
+    """
+    idx = np.flatnonzero(valid)
+    if len(idx) == 0:
+        return idx, np.zeros(2, dtype=np.int64), np.zeros(2), float(cell), 1, 1
+    pts = xy[idx]
+    origin = pts.min(axis=0).astype(np.float64)
+    extent = pts.max(axis=0) - origin
+    cell = float(max(cell, extent.max()/1024))  # far outliers shouldn't blow up the grid
+    nx, ny = (int(n)+1 for n in extent/cell)
+    ij = ((pts-origin)/cell).astype(np.int64)
+    cells = ij[:,1]*nx + ij[:,0]
+    order = idx[np.argsort(cells, kind="stable")]
+    starts = np.zeros(nx*ny+1, dtype=np.int64)
+    np.cumsum(np.bincount(cells, minlength=nx*ny), out=starts[1:])
+    return order, starts, origin, cell, nx, ny
 
 
 def init_networks(paths):
@@ -120,32 +396,114 @@ def init_networks(paths):
         networks.append(predict_init(dir_path))
     return networks
 
+# The prediction stack (and torch) is only imported by the prediction workers
+def predict_init(dir_path):
+    from kapnet.predict import init
+    return init(dir_path)
+
 def segment_floor(model, pcd):
+    from kapnet.predict import predict_floor
     return predict_floor(model, {}, pcd)
 
 def segment_bed(model, conf, pcd):
+    from kapnet.predict import predict_object
     return predict_object(model, conf, pcd)
 
 def read_pcd(path):
+    from kapnet.utils.io import read_sample
     return read_sample({"pcd": path})["pcd"]
 
+def _pcd_header(path):
+    """ Fields of the header of a PCD file, and the offset of its data """
+    header = {}
+    with open(path, "rb") as f:
+        for line in f:
+            if len(header) > 16:  # not a PCD file
+                return None
+            tokens = line.decode("ascii", "replace").split()
+            if not tokens or tokens[0].startswith("#"):
+                continue
+            header[tokens[0].upper()] = tokens[1:]
+            if tokens[0].upper() == "DATA":
+                header["OFFSET"] = f.tell()
+                return header
+    return None
+
+def read_points(path):
+    """ xyz of the points of a PCD file. Binary files with float32 x, y, z
+        fields are memory-mapped: the result is a read-only strided view of
+        the file, nothing is read until it's used. Other files are parsed
+        by kapnet.
+    """
+    try:
+        header = _pcd_header(path)
+        fields = header["FIELDS"]
+        sizes = [int(n) for n in header["SIZE"]]
+        counts = [int(n) for n in header.get("COUNT", ["1"]*len(fields))]
+        n_points = int(header["POINTS"][0])
+        i = fields.index("x")
+    except (OSError, TypeError, KeyError, ValueError, IndexError):
+        return read_pcd(path)["points"]
+    xyz = slice(i, i+3)
+    if (header["DATA"] != ["binary"] or fields[xyz] != ["x", "y", "z"]
+            or header["TYPE"][xyz] != ["F"]*3 or sizes[xyz] != [4]*3
+            or counts[xyz] != [1]*3):
+        return read_pcd(path)["points"]
+    offsets = np.cumsum([0] + [s*c for s, c in zip(sizes, counts)])
+    itemsize = int(offsets[-1])
+    data = np.memmap(path, dtype=np.uint8, mode="r")
+    if data.size < header["OFFSET"] + n_points*itemsize:  # truncated
+        return read_pcd(path)["points"]
+    return np.ndarray(
+        (n_points, 3), dtype="<f4", buffer=data,
+        offset=header["OFFSET"] + int(offsets[i]), strides=(itemsize, 4)
+    )
+
 def read_config(path):
+    from kapnet.utils.io import read_sample
     return read_sample({"conf": path})["conf"]
 
 def write_config(path, conf):
+    from kapnet.utils.io import write_sample
     write_sample({"conf": conf}, {"conf": path})
 
 def save_image_from_pcd(path, pcd):
+    from kapnet.utils.io import write_sample
+    from kapnet.annotations.image import generate_sample as image_generate_sample
     img = image_generate_sample(None, {"pcd": pcd})
     write_sample({"image": img}, {"image": path})
 
 
+def config_path(fp):
+    if (fp.parents[1] / "conf").exists():
+        return fp.parents[1] / "conf" / (fp.stem+".toml")
+    return fp.parent / (fp.stem+".toml")
+
+# Tables written by the floor and bed predictions
+_ANNOTATED = ("camera", "bed")
+
+def is_annotated(fp):
+    """ Cheap check of whether predict_config would have nothing left to do
+        for `fp`: only scans the config's text for the camera and bed tables
+    """
+    try:
+        with open(config_path(Path(fp))) as f:
+            text = f.read()
+    except OSError:
+        return False
+    first_table = re.search(r"^\s*\[", text, re.M)
+    top_level = text[:first_table.start()] if first_table else text
+    for key in _ANNOTATED:
+        # `[key]`, `[key.sub]`, `key = ...` or `key.sub = ...`, maybe quoted
+        name = r"""["']?{}["']?\s*""".format(key)
+        if not (re.search(r"^\s*\[\[?\s*{}[\].]".format(name), text, re.M)
+                or re.search(r"^\s*{}[=.]".format(name), top_level, re.M)):
+            return False
+    return True
+
 def predict_config(fp, floor_model, bed_model, temppath):
     with FileLock(temppath / (fp.name+".lock")):
-        if (fp.parents[1] / "conf").exists():
-            kaspardpath = fp.parents[1] / "conf" / (fp.stem+".toml")
-        else:
-            kaspardpath = fp.parent / (fp.stem+".toml")
+        kaspardpath = config_path(fp)
 
         pcd = read_pcd(fp)
 
@@ -162,61 +520,227 @@ def predict_config(fp, floor_model, bed_model, temppath):
     return pcd, kaspardpath
 
 
-def predict_server(queue, model_paths, tempdir):
+def predict_server(queue, requests, results, model_paths, tempdir, n_threads=None):
+    """ Worker loop: files requested by the GUI (`requests`) are annotated
+        first and the files of `queue` in between. A request is reported on
+        `results` as (pid, path, done, error) when it is taken, so that the
+        GUI knows which one is lost if the worker dies, and once it is done.
+    """
+    if n_threads is not None:
+        try:  # Workers share the cores, avoid oversubscribing them
+            import torch
+            torch.set_num_threads(n_threads)
+        except ImportError:
+            pass
     networks = init_networks(model_paths)
+    pid = os.getpid()
+    # One file at a time: kapnet's predict_floor and predict_object only take
+    # a single cloud, there is no batched forward pass to feed
     while True:
-        pcd_file = queue.get()
+        try:
+            pcd_file = requests.get_nowait()
+        except Empty:
+            pass
+        else:
+            results.put((pid, pcd_file, False, None))
+            try:
+                predict_config(Path(pcd_file), networks[0], networks[1], Path(tempdir))
+                results.put((pid, pcd_file, True, None))
+            except Exception as e:
+                results.put((pid, pcd_file, True, repr(e)))
+            continue
+
+        try:
+            pcd_file = queue.get(timeout=0.1)
+        except Empty:
+            continue
         try:
             predict_config(Path(pcd_file), networks[0], networks[1], Path(tempdir))
         except:
             pass
 
-def create_predict_server(model_paths):
+class PredictQueue():
+    """ Hands the pending files to the prediction workers, closest to the
+        file being viewed first. Only a few files wait in the workers' queue
+        at any time so that moving the focus reorders the whole backlog.
+    """
+    def __init__(self, queue, requests, results, processes=()):
+        self.queue = queue  # bounded queue read by the workers
+        self.requests, self.results = requests, results
+        self.processes = processes  # the workers, to notice when they die
+        self._pending = {}  # path -> index in the file list
+        self._done = set()  # paths already handed out or annotated
+        self._heap = []
+        self._focus = 0
+        self._futures = {}  # path -> Future of a request
+        self._taken = {}  # worker pid -> path of the request it's annotating
+        self._cond = threading.Condition()
+        threading.Thread(target=self._feed, daemon=True).start()
+        threading.Thread(target=self._collect, daemon=True).start()
+        threading.Thread(target=self._watch, daemon=True).start()
+
+    def request(self, path):
+        """ Asks the workers to annotate `path` before anything else. Returns a
+            Future which is resolved once its config holds the predictions
+        """
+        path = str(path)
+        future = Future()
+        if is_annotated(path):
+            future.set_result(path)
+            return future
+        if not self.alive():
+            future.set_exception(RuntimeError("prediction workers stopped"))
+            return future
+        with self._cond:
+            if path in self._futures:
+                return self._futures[path]
+            self._futures[path] = future
+        self.requests.put(path)
+        return future
+
+    def alive(self):
+        return not self.processes or any(p.is_alive() for p in self.processes)
+
+    def _collect(self):
+        while True:
+            pid, path, done, error = self.results.get()
+            with self._cond:
+                if not done:
+                    self._taken[pid] = path
+                    continue
+                self._taken.pop(pid, None)
+            self._resolve(path, error)
+
+    def _resolve(self, path, error=None):
+        with self._cond:
+            future = self._futures.pop(path, None)
+        if future is None:
+            return
+        if error is None:
+            future.set_result(path)
+        else:
+            future.set_exception(RuntimeError(error))
+
+    def _watch(self):
+        """ Fails the request a worker was annotating when it died (OOM kill,
+            crash on a bad cloud), and every request once no worker is left
+        """
+        while self.alive():
+            time.sleep(1)
+            for process in self.processes:
+                if process.exitcode is None:
+                    continue
+                with self._cond:
+                    path = self._taken.pop(process.pid, None)
+                if path is not None:
+                    self._resolve(path, "prediction worker died on {} (exit code {})".format(
+                        path, process.exitcode
+                    ))
+        self.close()
+
+    def close(self):
+        """ Fails the requests left unanswered, once the workers are stopped """
+        with self._cond:
+            futures, self._futures = self._futures, {}
+        for future in futures.values():
+            future.set_exception(RuntimeError("prediction workers stopped"))
+
+    def _priority(self, index):
+        # Nearest first, the next file before the previous one on ties
+        return abs(index-self._focus), index < self._focus
+
+    def put(self, path, index):
+        with self._cond:
+            if path in self._done:
+                return
+            self._pending[path] = index
+            heapq.heappush(self._heap, (self._priority(index), index, path))
+            self._cond.notify()
+
+    def set_focus(self, index):
+        with self._cond:
+            self._focus = index
+            self._heap = [
+                (self._priority(i), i, path) for path, i in self._pending.items()
+            ]
+            heapq.heapify(self._heap)
+
+    def clear(self):
+        with self._cond:
+            self._pending.clear()
+            self._heap = []
+
+    def _feed(self):
+        while True:
+            with self._cond:
+                while not self._heap:
+                    self._cond.wait()
+                _, index, path = heapq.heappop(self._heap)
+                if self._pending.get(path) != index:  # outdated entry
+                    continue
+                del self._pending[path]
+                self._done.add(path)
+            if not is_annotated(path):  # Don't make a worker read the pcd
+                self.queue.put(path)  # blocks while the workers are busy
+
+def create_predict_server(model_paths, n_workers=None):
+    """ Spawns `n_workers` prediction processes (half of the cores by default)
+        that each load the networks once and share the same queue. The
+        per-file lock keeps two workers from annotating the same file. The
+        workers are the only processes holding the networks: the GUI sends
+        its own predictions through PredictQueue.request.
+    """
+    if n_workers is None:
+        n_workers = max(1, mp.cpu_count()//2)
+    n_threads = max(1, mp.cpu_count()//n_workers)
     tempdir = TemporaryDirectory(prefix="ImgLabel-")
     ctx = mp.get_context('spawn')
-    queue = ctx.Queue()
-    p = ctx.Process(target=predict_server, args=(queue, model_paths, tempdir.name))
-    p.start()
-    return queue, p, tempdir
+    queue = ctx.Queue(maxsize=n_workers)
+    # results are written synchronously: a worker that dies right after
+    # taking a request has still reported it
+    requests, results = ctx.Queue(), ctx.SimpleQueue()
+    processes = [
+        ctx.Process(
+            target=predict_server,
+            args=(queue, requests, results, model_paths, tempdir.name, n_threads)
+        ) for _ in range(n_workers)
+    ]
+    for p in processes:
+        p.start()
+    return PredictQueue(queue, requests, results, processes), processes, tempdir
 
 def add_to_predict_queue(_parent, start, end, filelist=None, queue=None):
     if queue is None or filelist is None:
         raise RuntimeError("all arguments should be set !")
     for i in range(start, end+1):
-        queue.put(filelist[i])
-
+        queue.put(filelist[i], i)
 
 
-@jit(nopython=True)
-def rotate3d(vec, rot_mat):
-    """Gets rotation matrix from angle and applies it."""
-    return (rot_mat@vec.T).T
-@jit(nopython=True)
-def rotateX(theta, vec):
-    rot_mat = np.array([
+def rotation_matrix(alpha, beta):
+    """ Rotation around X by alpha, then around Z by pi, then around Y by beta """
+    ca, sa, cb, sb = np.cos(alpha), np.sin(alpha), np.cos(beta), np.sin(beta)
+    rot_x = np.array([
         [1.,0.,0.,],
-        [0.,np.cos(theta), -np.sin(theta)],
-        [0.,np.sin(theta),  np.cos(theta)],
-    ])
-    return rotate3d(vec, rot_mat)
-@jit(nopython=True)
-def rotateY(theta, vec):
-    rot_mat = np.array([
-        [np.cos(theta),0., np.sin(theta)],
-        [0.,1.,0.,],
-        [-np.sin(theta),0.,  np.cos(theta)],
+        [0.,ca, -sa],
+        [0.,sa,  ca],
     ])
-    return rotate3d(vec, rot_mat)
-@jit(nopython=True)
-def rotateZ(theta, vec):
-    rot_mat = np.array([
-        [np.cos(theta), -np.sin(theta),0.],
-        [np.sin(theta),  np.cos(theta),0.],
+    rot_z = np.array([
+        [-1.,0.,0.],
+        [0.,-1.,0.],
         [0.,0.,1.],
     ])
-    return rotate3d(vec, rot_mat)
+    rot_y = np.array([
+        [cb,0., sb],
+        [0.,1.,0.,],
+        [-sb,0.,  cb],
+    ])
+    return rot_y @ rot_z @ rot_x
+
 
-def fast_twconf(pcd, cfg): # about 5~7x faster
+def fast_twconf(pcd, cfg, out=None): # about 5~7x faster
+    """ Rotates pcd into the floor frame. The float32 result is written into
+        `out` when it has the right shape, so that it can be reused
+    """
     try:
         height = cfg["camera"].get("height", 2.6)
     except KeyError:
@@ -225,10 +749,39 @@ def fast_twconf(pcd, cfg): # about 5~7x faster
         180-cfg["camera"]["inclination"], cfg["camera"]["lateral_inclination"]
     )
     alpha, beta = (np.radians(a) for a in angles)
-    pcd = pcd.astype(np.float)
-    pcd = rotateX(alpha, pcd)
-    pcd = rotateZ(np.pi, pcd)
-    pcd = rotateY(beta,  pcd)
-    pcd[:,-1] = pcd[:,-1]+height
+    if pcd.dtype not in (np.float32, np.float64):
+        pcd = pcd.astype(np.float32)
+    if out is None or out.shape != pcd.shape or not out.flags.writeable:
+        out = np.empty(pcd.shape, dtype=np.float32)
+    from labelimg import kernels
+    with _parallel_lock:  # numba's default threading layer isn't thread safe
+        return kernels.transform(
+            pcd, rotation_matrix(alpha, beta), float(height), out
+        )
 
-    return pcd
\ No newline at end of file
+
+def warm_up_kernels():
+    """ Imports the kernels (compiling them on the very first launch) and
+        runs them once on dummy data, so that the first cloud doesn't wait
+    """
+    pcd = np.zeros((16, 3), dtype=np.float32)
+    cfg = {"camera": {"inclination": 90, "lateral_inclination": 0}}
+    rotated = fast_twconf(pcd, cfg)
+    apply_colormap(rotated[:,-1], ImgPcd.CMAP, ImgPcd.FLIM, ImgPcd.ZFLIM)
+    apply_colormap(rotated[:,-1], ImgPcd.CMAP_IMG, ImgPcd.FLIM, ImgPcd.ZFLIM)
+    xy = adapt_pcd(rotated[:,:2].copy())
+    grid = build_grid(xy, np.ones(len(xy), dtype=bool), ImgPcd.GRID_CELL)
+    from labelimg import kernels
+    corner = np.zeros(2)
+    kernels.segment_img(
+        xy, *grid, corner, corner, corner, np.zeros(len(xy), dtype=bool)
+    )
+    kernels.splat_points(
+        xy, np.zeros(len(xy), dtype=np.uint32), 1.0,
+        np.zeros((2, 3), dtype=np.uint32)
+    )
+    img = np.zeros((4, 4, 3), dtype=np.uint8)
+    kernels.blend_labels(
+        img, img, np.ones((4, 4), dtype=np.uint8), np.ones((4, 4), dtype=bool),
+        np.zeros((256, 3), dtype=np.uint8), 0.4, img.copy(), img.copy()
+    )
@@ -0,0 +1,124 @@
+""" Numba kernels of kaspard_utils. They live in their own module so that numba
+    is only imported (and the kernels compiled) once a point cloud is loaded.
+
+    The kernels are compiled eagerly for the signatures below and cached on
+    disk, so only the first launch pays for LLVM. The callers in
+    kaspard_utils cast their arguments to match.
+"""
+import numpy as np
+from numba import jit, prange
+from numba import boolean, float32, float64, int64, uint8, uint32, void
+
+
+def readonly(array_type):
+    """ Same array type, for memory-mapped inputs (np.load(mmap_mode="r")) """
+    return array_type.copy(readonly=True)
+
+
+@jit([
+    uint32[::1](float32[:], uint32[::1], float64, float64, uint32[::1]),
+    uint8[:,::1](float32[:], uint8[:,::1], float64, float64, uint8[:,::1]),
+], nopython=True, cache=True)
+def apply_colormap(values, lut, vmin, vmax, out):
+    n = lut.shape[0]
+    for i in range(values.shape[0]):
+        k = (values[i]-vmin)/(vmax-vmin)*n
+        # NaN and values below vmin map to the first entry
+        k = n-1 if k >= n else (int(k) if k >= 0 else 0)
+        out[i] = lut[k]
+    return out
+
+
+@jit([
+    boolean[::1](
+        xy_type, int64[::1], int64[::1], float64[::1], float64, int64, int64,
+        float64[::1], float64[::1], float64[::1], boolean[::1]
+    ) for xy_type in (float32[:,::1], readonly(float32[:,::1]))
+], nopython=True, cache=True)
+def segment_img(xy, order, starts, origin, cell, nx, ny, D, A, B, ok):
+    """ Marks the points of `xy` inside the rectangle spanned by AB and AD,
+        only visiting the grid cells overlapping its bounding box
+    """
+    AB, AD = B-A, D-A
+    AB2 = AB[0]*AB[0] + AB[1]*AB[1]
+    AD2 = AD[0]*AD[0] + AD[1]*AD[1]
+    C = D+AB
+    xmin = min(min(A[0], B[0]), min(C[0], D[0]))
+    xmax = max(max(A[0], B[0]), max(C[0], D[0]))
+    ymin = min(min(A[1], B[1]), min(C[1], D[1]))
+    ymax = max(max(A[1], B[1]), max(C[1], D[1]))
+    i0 = max(int(np.floor((xmin-origin[0])/cell)), 0)
+    i1 = min(int(np.floor((xmax-origin[0])/cell)), nx-1)
+    j0 = max(int(np.floor((ymin-origin[1])/cell)), 0)
+    j1 = min(int(np.floor((ymax-origin[1])/cell)), ny-1)
+    if i0 > i1:
+        return ok
+    for j in range(j0, j1+1):
+        for k in range(starts[j*nx+i0], starts[j*nx+i1+1]):
+            p = order[k]
+            APx, APy = xy[p,0]-A[0], xy[p,1]-A[1]
+            APAB = APx*AB[0] + APy*AB[1]
+            APAD = APx*AD[0] + APy*AD[1]
+            if 0<APAB and APAB<AB2 and 0<APAD and APAD<AD2:
+                ok[p] = True
+    return ok
+
+
+@jit([
+    uint32[:,::1](float32[:,:], uint32[::1], float64, uint32[:,::1]),
+    uint32[:,::1](
+        readonly(float32[:,:]), readonly(uint32[::1]), float64, uint32[:,::1]
+    ),
+], nopython=True, cache=True)
+def splat_points(pcd2d, colors, size, out):
+    """Writes the color of each point in the pixel it falls in (last one wins)"""
+    h, w = out.shape[0], out.shape[1]
+    for i in range(pcd2d.shape[0]):
+        x = int(np.floor(pcd2d[i, 0]*size))
+        y = int(np.floor(pcd2d[i, 1]*size))
+        if 0 <= x < w and 0 <= y < h:
+            out[y, x] = colors[i]
+    return out
+
+
+@jit([
+    float32[:,::1](float32[:,::1], float64[:,::1], float64, float32[:,::1]),
+    float32[:,::1](float32[:,:], float64[:,::1], float64, float32[:,::1]),
+    float32[:,::1](float64[:,:], float64[:,::1], float64, float32[:,::1]),
+    float32[:,::1](
+        readonly(float32[:,:]), float64[:,::1], float64, float32[:,::1]
+    ),
+], nopython=True, parallel=True, cache=True)
+def transform(pcd, rot_mat, height, out):
+    """Applies rot_mat and shifts z by height in a single pass, writing into out"""
+    for i in prange(pcd.shape[0]):
+        x, y, z = pcd[i,0], pcd[i,1], pcd[i,2]
+        out[i,0] = rot_mat[0,0]*x + rot_mat[0,1]*y + rot_mat[0,2]*z
+        out[i,1] = rot_mat[1,0]*x + rot_mat[1,1]*y + rot_mat[1,2]*z
+        out[i,2] = rot_mat[2,0]*x + rot_mat[2,1]*y + rot_mat[2,2]*z + height
+    return out
+
+
+@jit(
+    void(
+        readonly(uint8[:,:,:]), readonly(uint8[:,:,:]), readonly(uint8[:,:]),
+        readonly(boolean[:,:]), readonly(uint8[:,::1]), float64,
+        uint8[:,:,::1], uint8[:,:,::1]
+    ), nopython=True, cache=True
+)
+def blend_labels(img, zimg, ids, shown, lut, alpha, out, zout):
+    """ Copies both views into out/zout, blending the shown pixels with a
+        label (ids > 0) with its color: alpha*pixel + (1-alpha)*lut[id]
+    """
+    for y in range(ids.shape[0]):
+        for x in range(ids.shape[1]):
+            k = ids[y, x]
+            if k == 0 or not shown[y, x]:
+                for c in range(3):
+                    out[y, x, c] = img[y, x, c]
+                    zout[y, x, c] = zimg[y, x, c]
+            else:
+                for c in range(3):
+                    color = (1-alpha)*lut[k, c]
+                    out[y, x, c] = np.uint8(alpha*img[y, x, c] + color)
+                    zout[y, x, c] = np.uint8(alpha*zimg[y, x, c] + color)
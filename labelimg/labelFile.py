@@ -11,8 +11,6 @@ import numpy as np
 import sys
 import toml
 
-from kapnet.data.datasets import read_sample
-
 infix = ".pcd"
 suffix = ".toml"
 def convertPoints2RotatedBndBox(shape):
@@ -93,6 +91,7 @@ class KaspardReader:
 
     @staticmethod
     def read_conf(configfile):
+        from kapnet.data.datasets import read_sample
         config = read_sample({"conf": configfile})["conf"]
         return config
 
@@ -10,7 +10,6 @@ except ImportError:
     from PyQt4.QtCore import *
 
 from labelimg.lib import distance
-import open3d
 import numpy as np
 import math
 
@@ -83,9 +82,14 @@ class Shape(object):
             # is used for drawing the pending line a different color.
             self.line_color = line_color
 
+    @property
+    def segment_id(self):
+        """ Id of the label in the segmentation, 0 being no label """
+        return Shape.default_labels.index(self.label)+1
+
     @property
     def segment_color(self):
-        return DEFAULT_SEGMENT_COLORS[Shape.default_labels.index(self.label)+1]
+        return DEFAULT_SEGMENT_COLORS[self.segment_id]
 
     def rotate(self, theta):
         for i, p in enumerate(self.points):
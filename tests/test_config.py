@@ -0,0 +1,60 @@
+
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from unittest import TestCase
+
+from labelimg.kaspard_utils import is_annotated
+
+CAMERA = "[camera]\nheight = 2.6\ninclination = 120.0\n"
+
+
+class TestIsAnnotated(TestCase):
+
+    def setUp(self):
+        self._dir = TemporaryDirectory()
+        folder = Path(self._dir.name) / "sample"
+        folder.mkdir()
+        self.pcd = folder / "cloud.pcd"
+
+    def tearDown(self):
+        self._dir.cleanup()
+
+    def assertAnnotated(self, text, expected=True):
+        (self.pcd.parent / "cloud.toml").write_text(text)
+        self.assertEqual(is_annotated(self.pcd), expected, text)
+
+    def test_no_config(self):
+        self.assertFalse(is_annotated(self.pcd))
+
+    def test_tables(self):
+        self.assertAnnotated(CAMERA + "[bed]\nx = 1.0\n")
+        self.assertAnnotated(CAMERA + "[[bed]]\nx = 1.0\n")
+        self.assertAnnotated(CAMERA + '[ "bed" ]\nx = 1.0\n')
+
+    def test_dotted_tables(self):
+        self.assertAnnotated(CAMERA + "[bed.box]\nx = 1.0\n")
+        self.assertAnnotated(
+            "[camera.intrinsics]\nfx = 500.0\n[bed . box]\nx = 1.0\n"
+        )
+
+    def test_top_level_keys(self):
+        self.assertAnnotated("camera = { height = 2.6 }\nbed = { x = 1.0 }\n")
+        self.assertAnnotated("bed = { x = 1.0 }\n" + CAMERA)
+
+    def test_dotted_keys(self):
+        self.assertAnnotated("bed.x = 1.0\nbed.y = 2.0\n" + CAMERA)
+        self.assertAnnotated("camera.height = 2.6\nbed . x = 1.0\n")
+
+    def test_missing(self):
+        self.assertAnnotated(CAMERA, False)
+        self.assertAnnotated("[bed]\nx = 1.0\n", False)
+        self.assertAnnotated(CAMERA + "[bedroom]\nx = 1.0\n", False)
+        self.assertAnnotated(CAMERA + "beds = 2\n", False)
+
+    def test_commented_out(self):
+        self.assertAnnotated(CAMERA + "# [bed]\n# x = 1.0\n", False)
+        self.assertAnnotated(CAMERA + "#bed = { x = 1.0 }\n", False)
+
+    def test_key_of_another_table(self):
+        self.assertAnnotated(CAMERA + "bed = { x = 1.0 }\n", False)
+        self.assertAnnotated(CAMERA + "bed.x = 1.0\n", False)
@@ -0,0 +1,108 @@
+
+from types import SimpleNamespace
+from unittest import TestCase, skipIf
+
+import numpy as np
+
+from labelimg.colormaps import MAGMA, VIRIDIS
+from labelimg.kaspard_utils import ImgPcd, apply_colormap, build_grid
+from labelimg import kernels
+
+try:
+    from matplotlib import colormaps
+    from matplotlib.colors import Normalize
+except ImportError:
+    colormaps = None
+
+
+def inside_rectangle(xy, D, A, B):
+    """ Brute force version of kernels.segment_img """
+    AB, AD, AP = B-A, D-A, xy.astype(np.float64)-A
+    with np.errstate(invalid="ignore"):
+        APAB, APAD = AP @ AB, AP @ AD
+        return (0 < APAB) & (APAB < AB @ AB) & (0 < APAD) & (APAD < AD @ AD)
+
+
+class TestSegmentImg(TestCase):
+
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        self.xy = rng.uniform(-0.5, 2.5, (20000, 2)).astype(np.float32)
+        self.xy[::97] = np.nan
+        self.xy[1::101, 0] = np.inf
+        self.xy[2::103, 1] = -np.inf
+        self.xy[3] = (1e6, -1e6)  # far outlier
+        self.valid = np.isfinite(self.xy).all(axis=1)
+        self.grid = build_grid(self.xy, self.valid, ImgPcd.GRID_CELL)
+
+    def segment(self, D, A, B):
+        D, A, B = (np.array(p, dtype=np.float64) for p in (D, A, B))
+        ok = np.zeros(len(self.xy), dtype=bool)
+        kernels.segment_img(self.xy, *self.grid, D, A, B, ok)
+        expected = inside_rectangle(self.xy, D, A, B) & self.valid
+        np.testing.assert_array_equal(ok, expected)
+        return ok
+
+    def test_grid_buckets_valid_points(self):
+        order, starts, origin, cell, nx, ny = self.grid
+        self.assertEqual(sorted(order), list(np.flatnonzero(self.valid)))
+        self.assertEqual(starts[-1], len(order))
+
+    def test_axis_aligned(self):
+        self.assertTrue(self.segment((0.2, 1.0), (0.2, 0.3), (1.5, 0.3)).any())
+
+    def test_rotated(self):
+        for angle in np.linspace(0, 2*np.pi, 13):
+            c, s = np.cos(angle), np.sin(angle)
+            A = np.array([1.0, 1.0])
+            B = A + 0.8*np.array([c, s])
+            D = A + 0.3*np.array([-s, c])
+            self.assertTrue(self.segment(D, A, B).any())
+
+    def test_outside_the_cloud(self):
+        self.assertFalse(self.segment((5.0, 6.0), (5.0, 5.0), (6.0, 5.0)).any())
+        self.assertFalse(self.segment((-6.0, -5.0), (-6.0, -6.0), (-5.0, -6.0)).any())
+
+    def test_covering_the_cloud(self):
+        ok = self.segment((-1.0, 3.0), (-1.0, -1.0), (3.0, -1.0))
+        self.assertEqual(ok.sum(), self.valid.sum() - 1)  # all but the outlier
+
+    def test_degenerate(self):
+        self.assertFalse(self.segment((1.0, 1.0), (1.0, 1.0), (1.0, 1.0)).any())
+
+    def test_no_valid_point(self):
+        self.valid[:] = False
+        self.grid = build_grid(self.xy, self.valid, ImgPcd.GRID_CELL)
+        self.assertFalse(self.segment((0.2, 1.0), (0.2, 0.3), (1.5, 0.3)).any())
+
+
+class TestToImage(TestCase):
+
+    def test_matches_rot90(self):
+        h, w = 6, 9
+        img_pcd = SimpleNamespace(img=np.zeros((h, w), dtype=np.uint8))
+        for values in (np.arange(h*w), np.arange(h*w*3).reshape(-1, 3)):
+            expected = np.rot90(values.reshape((h, w)+values.shape[1:]), 2)
+            image = ImgPcd.to_image(img_pcd, values)
+            np.testing.assert_array_equal(image, expected)
+            self.assertTrue(np.shares_memory(image, values))
+
+
+class TestApplyColormap(TestCase):
+
+    def test_clipping(self):
+        values = np.array([-1.0, 0.0, 0.5, 1.0, 2.0, np.nan, np.inf, -np.inf])
+        colors = apply_colormap(values, VIRIDIS, 0.0, 1.0)
+        np.testing.assert_array_equal(
+            colors, VIRIDIS[[0, 0, 128, 255, 255, 0, 255, 0]]
+        )
+
+    @skipIf(colormaps is None, "matplotlib isn't installed")
+    def test_matches_matplotlib(self):
+        rng = np.random.default_rng(0)
+        values = rng.uniform(-1.0, 4.0, 10000).astype(np.float32)
+        for name, lut in (("magma", MAGMA), ("viridis", VIRIDIS)):
+            colors = apply_colormap(values, lut, 0.0, 3.0)
+            norm = Normalize(0.0, 3.0, clip=True)
+            expected = colormaps[name](norm(values))[:, :3]*255
+            np.testing.assert_allclose(colors, expected, atol=0.51)
@@ -0,0 +1,132 @@
+
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from unittest import TestCase, mock
+
+import numpy as np
+
+from labelimg.kaspard_utils import read_points
+
+DTYPES = {
+    ("F", 4): "<f4", ("F", 8): "<f8", ("U", 1): "u1", ("U", 4): "<u4", ("I", 2): "<i2",
+}
+
+
+def write_pcd(path, fields, n_points=50, data="binary", truncate=0, seed=0):
+    """ Writes a PCD file of random `fields`, a list of (name, type, size,
+        count). Returns its structured array, the reference parse
+    """
+    dtype = np.dtype([
+        (name, DTYPES[type_, size], (count,)) if count > 1
+        else (name, DTYPES[type_, size])
+        for name, type_, size, count in fields
+    ])
+    rng = np.random.default_rng(seed)
+    raw = rng.integers(0, 256, n_points*dtype.itemsize, dtype=np.uint8)
+    array = raw.view(dtype)
+    for name, type_, _, _ in fields:
+        if type_ == "F":
+            array[name] = rng.uniform(-5, 5, array[name].shape)
+    header = "\n".join([
+        "# .PCD v0.7 - Point Cloud Data file format",
+        "VERSION 0.7",
+        "FIELDS " + " ".join(f[0] for f in fields),
+        "SIZE " + " ".join(str(f[2]) for f in fields),
+        "TYPE " + " ".join(f[1] for f in fields),
+        "COUNT " + " ".join(str(f[3]) for f in fields),
+        "WIDTH {}".format(n_points),
+        "HEIGHT 1",
+        "VIEWPOINT 0 0 0 1 0 0 0",
+        "POINTS {}".format(n_points),
+        "DATA " + data,
+    ]) + "\n"
+    body = array.tobytes()
+    with open(path, "wb") as f:
+        f.write(header.encode("ascii") + body[:len(body)-truncate])
+    return array
+
+
+def xyz(array):
+    return np.stack([array["x"], array["y"], array["z"]], axis=1)
+
+
+class TestReadPoints(TestCase):
+
+    def setUp(self):
+        self._dir = TemporaryDirectory()
+        self.path = Path(self._dir.name) / "cloud.pcd"
+        patcher = mock.patch("labelimg.kaspard_utils.read_pcd")
+        self.read_pcd = patcher.start()
+        self.read_pcd.return_value = {"points": "parsed by kapnet"}
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        self._dir.cleanup()
+
+    def assertMapped(self, fields, **kwargs):
+        array = write_pcd(self.path, fields, **kwargs)
+        points = read_points(self.path)
+        self.read_pcd.assert_not_called()
+        np.testing.assert_array_equal(points, xyz(array))
+        self.assertEqual(points.dtype, np.float32)
+        self.assertFalse(points.flags.writeable)
+        del points
+
+    def assertParsed(self, fields, **kwargs):
+        write_pcd(self.path, fields, **kwargs)
+        self.assertEqual(read_points(self.path), "parsed by kapnet")
+        self.read_pcd.assert_called_once_with(self.path)
+
+    def test_xyz_only(self):
+        self.assertMapped([("x", "F", 4, 1), ("y", "F", 4, 1), ("z", "F", 4, 1)])
+
+    def test_xyz_first(self):
+        self.assertMapped([
+            ("x", "F", 4, 1), ("y", "F", 4, 1), ("z", "F", 4, 1),
+            ("intensity", "F", 4, 1), ("ring", "I", 2, 1),
+        ])
+
+    def test_xyz_after_other_fields(self):
+        self.assertMapped([
+            ("t", "U", 4, 1), ("label", "U", 1, 1),
+            ("x", "F", 4, 1), ("y", "F", 4, 1), ("z", "F", 4, 1),
+            ("rgb", "U", 4, 1),
+        ])
+
+    def test_count_before_xyz(self):
+        self.assertMapped([
+            ("normal", "F", 4, 3), ("histogram", "U", 1, 5),
+            ("x", "F", 4, 1), ("y", "F", 4, 1), ("z", "F", 4, 1),
+            ("rgba", "U", 1, 4),
+        ])
+
+    def test_no_points(self):
+        self.assertMapped(
+            [("x", "F", 4, 1), ("y", "F", 4, 1), ("z", "F", 4, 1)], n_points=0
+        )
+
+    def test_truncated(self):
+        self.assertParsed(
+            [("x", "F", 4, 1), ("y", "F", 4, 1), ("z", "F", 4, 1)], truncate=1
+        )
+
+    def test_ascii(self):
+        self.assertParsed(
+            [("x", "F", 4, 1), ("y", "F", 4, 1), ("z", "F", 4, 1)], data="ascii"
+        )
+
+    def test_compressed(self):
+        self.assertParsed(
+            [("x", "F", 4, 1), ("y", "F", 4, 1), ("z", "F", 4, 1)],
+            data="binary_compressed"
+        )
+
+    def test_double_precision(self):
+        self.assertParsed([("x", "F", 8, 1), ("y", "F", 8, 1), ("z", "F", 8, 1)])
+
+    def test_other_field_order(self):
+        self.assertParsed([("x", "F", 4, 1), ("z", "F", 4, 1), ("y", "F", 4, 1)])
+
+    def test_not_a_pcd_file(self):
+        self.path.write_bytes(bytes(range(256)) * 4)
+        self.assertEqual(read_points(self.path), "parsed by kapnet")